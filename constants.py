@@ -19,6 +19,14 @@ DEV_CONFIG = {
     # PLUGINS
     "REQUIREMENTS_FILE" :  '/files/requirements.txt',       # Path to requirements file
 
+    # Lambda layer providing pyarrow for Parquet sample manifests,
+    # e.g. the AWS SDK for pandas layer (AWSSDKPandas-Python38).
+    # Parquet manifests are only accepted when this is set.
+    "PYARROW_LAYER_ARN" : None,
+    # Memory (MB) of the initial Lambda function when the pyarrow layer is set,
+    # importing pyarrow alone uses most of the default 128 MB
+    "PYARROW_LAMBDA_MEMORY_MB" : 1024,
+
 }
 
 
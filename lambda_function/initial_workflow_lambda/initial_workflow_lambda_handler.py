@@ -4,7 +4,10 @@ import botocore.exceptions
 import json
 import logging
 import uuid
-from collections import defaultdict
+import csv
+import sys
+from urllib.parse import quote
+from array import array
 
 OUTPUT_S3_LOCATION = os.environ['OUTPUT_S3_LOCATION']    
 OMICS_ROLE = os.environ['OMICS_ROLE']        
@@ -35,13 +38,125 @@ def localize_s3_file(bucket, _key, local_file):
             raise
     return
 
-def build_input_payload_for_r2r_gatk_fastq2vcf(sample_manifest_csv):
+MANIFEST_HEADER = ('sample_name', 'read_group', 'fastq_1', 'fastq_2', 'platform')
+MANIFEST_FORMATS = ('.csv', '.jsonl', '.parquet')
+
+def manifest_format(filename):
+    for _ext in MANIFEST_FORMATS:
+        if filename.lower().endswith(_ext):
+            return _ext
+    raise Exception(f"Unsupported sample manifest format: {filename}")
+
+def manifest_row(values, location):
+    # every manifest field is required, extra fields are ignored
+    row = tuple('' if _val is None else str(_val).strip() for _val in values)
+    for _col, _val in zip(MANIFEST_HEADER, row):
+        if not _val:
+            raise Exception(f"Invalid sample manifest {location}, empty {_col}")
+    return row
+
+def check_manifest_columns(columns, location):
+    missing = [_col for _col in MANIFEST_HEADER if _col not in columns]
+    if missing:
+        raise Exception(f"Invalid sample manifest {location}, missing {', '.join(missing)}")
+
+def iter_manifest_csv(sample_manifest_csv):
+    with open(sample_manifest_csv, newline='') as smc:
+        reader = csv.reader(smc)
+        header = [_col.strip() for _col in next(reader, [])]
+        check_manifest_columns(header, "CSV header")
+        positions = [header.index(_col) for _col in MANIFEST_HEADER]
+        for _row in reader:
+            if not _row:
+                continue
+            location = f"CSV row at line {reader.line_num}"
+            if len(_row) != len(header):
+                raise Exception(f"Invalid sample manifest {location}")
+            yield manifest_row((_row[_pos] for _pos in positions), location)
+
+def iter_manifest_jsonl(sample_manifest_jsonl):
+    with open(sample_manifest_jsonl) as smj:
+        for _num, _line in enumerate(smj, start=1):
+            if not _line.strip():
+                continue
+            location = f"JSONL record at line {_num}"
+            try:
+                _record = json.loads(_line)
+            except ValueError:
+                raise Exception(f"Invalid sample manifest {location}, not valid JSON")
+            if not isinstance(_record, dict):
+                raise Exception(f"Invalid sample manifest {location}, not a JSON object")
+            check_manifest_columns(_record, location)
+            yield manifest_row((_record[_col] for _col in MANIFEST_HEADER), location)
+
+def iter_manifest_parquet(sample_manifest_parquet):
+    # pyarrow is not part of the Lambda runtime,
+    # it must be provided through a Lambda layer
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Parquet sample manifests require pyarrow, add a pyarrow Lambda layer")
+
+    pf = pq.ParquetFile(sample_manifest_parquet)
+    check_manifest_columns(pf.schema_arrow.names, "Parquet schema")
+    # read in record batches so memory stays bounded for large cohorts
+    _num = 0
+    for _batch in pf.iter_batches(columns=list(MANIFEST_HEADER)):
+        _columns = [_batch.column(_col).to_pylist() for _col in MANIFEST_HEADER]
+        for _row in zip(*_columns):
+            _num += 1
+            yield manifest_row(_row, f"Parquet row {_num}")
+
+MANIFEST_READERS = {
+    '.csv': iter_manifest_csv,
+    '.jsonl': iter_manifest_jsonl,
+    '.parquet': iter_manifest_parquet
+}
+
+class SampleIndex:
     """
-    Function specific to the HealthOmics Ready2Run workflow
-    GATK-BP Germline fq2vcf for 30x genome
+    Compact index of sample -> read group -> lane pairs
+
+    Lane values are kept in flat column lists and each
+    read group holds an array of lane positions, so
+    every lane of a read group is kept.
     """
-    # Validate if sample manifest in acceptable format
+    __slots__ = ('samples', 'fastq_1', 'fastq_2', 'platform')
+
+    def __init__(self):
+        self.samples = {}
+        self.fastq_1 = []
+        self.fastq_2 = []
+        self.platform = []
+
+    def add(self, sample_name, read_group, fastq_1, fastq_2, platform):
+        read_groups = self.samples.setdefault(sys.intern(sample_name), {})
+        lanes = read_groups.get(read_group)
+        if lanes is None:
+            lanes = read_groups[sys.intern(read_group)] = array('L')
+        lanes.append(len(self.fastq_1))
+        self.fastq_1.append(fastq_1)
+        self.fastq_2.append(fastq_2)
+        self.platform.append(sys.intern(platform))
+
+    def fastq_pairs(self, sample_name):
+        for _rg, _lanes in self.samples[sample_name].items():
+            for _lane in _lanes:
+                yield {
+                    'read_group': _rg,
+                    'fastq_1': self.fastq_1[_lane],
+                    'fastq_2': self.fastq_2[_lane],
+                    'platform': self.platform[_lane]
+                }
+
+def build_sample_index(sample_manifest):
     """
+    Build a SampleIndex from a sample manifest in
+    CSV, JSONL or Parquet format
+
+    All formats need the columns below, extra columns
+    are ignored and empty values are rejected.
+
     Example CSV schema
 
     sample_name,read_group,fastq_1,fastq_2,platform
@@ -49,41 +164,59 @@ def build_input_payload_for_r2r_gatk_fastq2vcf(sample_manifest_csv):
     SampleX,RG1,s3://path/to/SampleX/RG1/002_R1.fastq.gz,s3://path/to/SampleX/RG1/002_R2.fastq.gz,solid
     SampleX,RG2,s3://path/to/SampleX/RG2/001_R1.fastq.gz,s3://path/to/SampleX/RG2/001_R2.fastq.gz,solid
     SampleX,RG2,s3://path/to/SampleX/RG2/002_R1.fastq.gz,s3://path/to/SampleX/RG2/002_R2.fastq.gz,solid
+
+    Example JSONL schema
+
+    {"sample_name": "SampleX", "read_group": "RG1", "fastq_1": "s3://...", "fastq_2": "s3://...", "platform": "solid"}
+    """
+    read_manifest = MANIFEST_READERS[manifest_format(sample_manifest)]
+
+    index = SampleIndex()
+    for _row in read_manifest(sample_manifest):
+        index.add(*_row)
+    return index
+
+def build_input_payload_for_r2r_gatk_fastq2vcf(sample_manifest):
+    """
+    Function specific to the HealthOmics Ready2Run workflow
+    GATK-BP Germline fq2vcf for 30x genome
+
+    Yields the input payload one sample at a time,
+    so only the index and a single payload are held
+    in memory
     """
-    
-    with open(sample_manifest_csv) as smc:
-        contents = smc.readlines()
-    
-    header = contents[0].strip()
-    if header != "sample_name,read_group,fastq_1,fastq_2,platform":
-        raise Exception("Invalid sample manifest CSV header")
-    
+    index = build_sample_index(sample_manifest)
+
     # prepare workflow input payload per sample
-    samples = defaultdict(dict)
-    for _line in contents[1:]:
-        sample_name,read_group,fastq_1,fastq_2,platform = _line.strip().split(',')
-        if read_group not in samples[sample_name]:
-            samples[sample_name][read_group] = {}
-        samples[sample_name][read_group]['fastq_1'] = fastq_1
-        samples[sample_name][read_group]['fastq_2'] = fastq_2
-        samples[sample_name][read_group]['platform'] = platform
-    
-    samples_params = []
-    for _sample, _obj in samples.items():
+    for _sample in index.samples:
         logging.info(f"Creating input payload for sample: {_sample}")
-        _params = {}
-        _params['sample_name'] = _sample
-        _params['fastq_pairs'] = []
-        for _rg, _details in _obj.items():
-            _params['fastq_pairs'].append({
-                'read_group': _rg,
-                'fastq_1': _details['fastq_1'],
-                'fastq_2': _details['fastq_2'],
-                'platform': _details['platform']
-            })
-        samples_params.append(_params)
-
-    return samples_params
+        yield {
+            'sample_name': _sample,
+            'fastq_pairs': list(index.fastq_pairs(_sample))
+        }
+
+def store_rejected_parameters(params, manifest_key):
+    """
+    Write an input payload rejected by StartRun to the
+    output location and return its S3 URI. The workflow
+    is not started from this copy, it is kept so the
+    sample can be inspected and resubmitted.
+    """
+    bucket, prefix = OUTPUT_S3_LOCATION.replace("s3://", "").split("/", 1)
+    sample_name = quote(params['sample_name'], safe='')
+    key = f"{prefix.rstrip('/')}/parameters/{manifest_key}/{sample_name}.json"
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(params).encode('utf-8'),
+        ContentType='application/json'
+    )
+    return f"s3://{bucket}/{key}"
+
+def is_rejected_request(client_error):
+    error = client_error.response.get('Error', {})
+    status = client_error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return error.get('Code') in ('ValidationException', 'RequestEntityTooLarge') or status == 413
 
 # Lambda function triggered by S3 event
 # and launch of initial workflow
@@ -104,14 +237,13 @@ def handler(event, context):
         raise Exception("Multiple s3 files in event not yet suppported")
     #TODO: implement processing of multiple files in future version 
 
-    # dowload manifest CSV
-    local_file = "/tmp/sample_manifest.csv"
+    # dowload sample manifest
+    local_file = "/tmp/sample_manifest" + manifest_format(filename)
     localize_s3_file(bucket_name, filename, local_file)
-    logging.info(f"Downloaded manifest CSV to: {local_file}")
+    logging.info(f"Downloaded sample manifest to: {local_file}")
 
-    multi_sample_params = build_input_payload_for_r2r_gatk_fastq2vcf(local_file)
     error_count = 0
-    for _item in multi_sample_params:
+    for _item in build_input_payload_for_r2r_gatk_fastq2vcf(local_file):
         _samplename = _item['sample_name']
         logging.info(f"Starting workflow for sample: {_samplename}")
         run_name = f"Sample_{_samplename}_" + str(uuid.uuid4())
@@ -134,11 +266,18 @@ def handler(event, context):
         except botocore.exceptions.ClientError as ce:
             logging.error( "boto3 client error : " + ce.__str__())
             error_count += 1
+            # keep payloads StartRun refused, e.g. when they are too large
+            if is_rejected_request(ce):
+                try:
+                    params_uri = store_rejected_parameters(_item, filename)
+                    logging.error(f"Workflow NOT started for sample {_samplename}, input payload saved to: {params_uri}")
+                except botocore.exceptions.ClientError as se:
+                    logging.error(f"Workflow NOT started for sample {_samplename}, unable to save input payload : " + se.__str__())
         except Exception as e:
             logging.error( "unknown error : " + e.__str__())
             error_count += 1
         
 
     if error_count > 0:
-        raise Exception("Error launching some workflows, check logs")
+        raise Exception(f"Error launching {error_count} workflows, check logs")
     return
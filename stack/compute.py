@@ -256,6 +256,10 @@ class omics_workflow_Stack(Stack):
         ################################################################################################
         #################################### Lambda Initial ############################################
 
+        # Parquet manifests need pyarrow, which is not part of
+        # the Lambda runtime, only accept them if a layer is set
+        pyarrow_layer_arn = config.get("PYARROW_LAYER_ARN")
+
         # Create Lambda function to submit 
         # initial HealthOmics workflow
         initial_workflow_lambda = lambda_.Function(
@@ -265,7 +269,10 @@ class omics_workflow_Stack(Stack):
             code=lambda_.Code.from_asset("lambda_function/initial_workflow_lambda"),
             role=lambda_role,
             timeout=Duration.seconds(60),
-            retry_attempts=1,
+            # no retry, a retried manifest would start the
+            # already launched samples a second time
+            retry_attempts=0,
+            memory_size=config["PYARROW_LAMBDA_MEMORY_MB"] if pyarrow_layer_arn else None,
             environment={
                 "OMICS_ROLE": omics_role.role_arn,
                 "OUTPUT_S3_LOCATION": "s3://" + bucket_output.bucket_name + "/outputs",
@@ -275,15 +282,25 @@ class omics_workflow_Stack(Stack):
             }                  
         )
 
+        manifest_suffixes = [".csv", ".jsonl"]
+        if pyarrow_layer_arn:
+            initial_workflow_lambda.add_layers(
+                lambda_.LayerVersion.from_layer_version_arn(
+                    self, f"{APP_NAME}_pyarrow_layer", pyarrow_layer_arn
+                )
+            )
+            manifest_suffixes.append(".parquet")
+
         # Add S3 event source to Lambda
-        # should trigger if a .csv is 
+        # should trigger if a manifest is
         # dropped in a specified prefix
-        initial_workflow_lambda.add_event_source(
-            lambda_event_sources.S3EventSource(
-            bucket_input, 
-            events=[s3.EventType.OBJECT_CREATED],
-            filters=[s3.NotificationKeyFilter(prefix="fastqs/", suffix=".csv")]
-        ))
+        for manifest_suffix in manifest_suffixes:
+            initial_workflow_lambda.add_event_source(
+                lambda_event_sources.S3EventSource(
+                bucket_input, 
+                events=[s3.EventType.OBJECT_CREATED],
+                filters=[s3.NotificationKeyFilter(prefix="fastqs/", suffix=manifest_suffix)]
+            ))
 
         ################################################################################################
         #################################### Lambda Post Initial #######################################
@@ -0,0 +1,55 @@
+import os
+import sys
+import types
+
+import pytest
+
+HANDLER_DIR = os.path.join(os.path.dirname(__file__), "..", "lambda_function", "initial_workflow_lambda")
+
+
+class FakeClient:
+    """Records every call made to a boto3 client"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def _call(**kwargs):
+            self.calls.append((name, kwargs))
+            return {"id": str(len(self.calls))}
+        return _call
+
+
+# the handler creates its boto3 clients at import time
+boto3 = types.ModuleType("boto3")
+boto3.client = lambda *args, **kwargs: FakeClient()
+botocore = types.ModuleType("botocore")
+botocore_exceptions = types.ModuleType("botocore.exceptions")
+
+
+class ClientError(Exception):
+    def __init__(self, error_response, operation_name):
+        super().__init__(f"{operation_name}: {error_response['Error']['Code']}")
+        self.response = error_response
+
+
+botocore_exceptions.ClientError = ClientError
+botocore.exceptions = botocore_exceptions
+sys.modules.setdefault("boto3", boto3)
+sys.modules.setdefault("botocore", botocore)
+sys.modules.setdefault("botocore.exceptions", botocore_exceptions)
+
+os.environ.setdefault("OUTPUT_S3_LOCATION", "s3://output-bucket/outputs")
+os.environ.setdefault("OMICS_ROLE", "arn:aws:iam::000000000000:role/omics")
+os.environ.setdefault("WORKFLOW_ID", "9500764")
+os.environ.setdefault("ECR_REGISTRY", "000000000000.dkr.ecr.us-east-1.amazonaws.com")
+os.environ.setdefault("LOG_LEVEL", "INFO")
+sys.path.insert(0, HANDLER_DIR)
+
+
+@pytest.fixture
+def handler_module(monkeypatch):
+    import initial_workflow_lambda_handler
+    monkeypatch.setattr(initial_workflow_lambda_handler, "omics", FakeClient())
+    monkeypatch.setattr(initial_workflow_lambda_handler, "s3", FakeClient())
+    return initial_workflow_lambda_handler
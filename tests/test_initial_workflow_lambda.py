@@ -0,0 +1,223 @@
+import inspect
+import json
+import shutil
+import sys
+import tracemalloc
+
+import pytest
+
+HEADER = "sample_name,read_group,fastq_1,fastq_2,platform\n"
+ROWS = [
+    ("S1", "RG1", "s3://b/S1/L001_R1.fastq.gz", "s3://b/S1/L001_R2.fastq.gz", "illumina"),
+    ("S1", "RG1", "s3://b/S1/L002_R1.fastq.gz", "s3://b/S1/L002_R2.fastq.gz", "illumina"),
+    ("S1", "RG2", "s3://b/S1/L003_R1.fastq.gz", "s3://b/S1/L003_R2.fastq.gz", "illumina"),
+    ("S2", "RG1", "s3://b/S2/L001_R1.fastq.gz", "s3://b/S2/L001_R2.fastq.gz", "illumina"),
+]
+EXPECTED = [
+    {
+        "sample_name": "S1",
+        "fastq_pairs": [
+            {"read_group": "RG1", "fastq_1": "s3://b/S1/L001_R1.fastq.gz", "fastq_2": "s3://b/S1/L001_R2.fastq.gz", "platform": "illumina"},
+            {"read_group": "RG1", "fastq_1": "s3://b/S1/L002_R1.fastq.gz", "fastq_2": "s3://b/S1/L002_R2.fastq.gz", "platform": "illumina"},
+            {"read_group": "RG2", "fastq_1": "s3://b/S1/L003_R1.fastq.gz", "fastq_2": "s3://b/S1/L003_R2.fastq.gz", "platform": "illumina"},
+        ],
+    },
+    {
+        "sample_name": "S2",
+        "fastq_pairs": [
+            {"read_group": "RG1", "fastq_1": "s3://b/S2/L001_R1.fastq.gz", "fastq_2": "s3://b/S2/L001_R2.fastq.gz", "platform": "illumina"},
+        ],
+    },
+]
+COLUMNS = HEADER.strip().split(",")
+
+
+def write_csv(path, header=HEADER, rows=ROWS, extra=""):
+    path.write_text(header + "".join(",".join(_row) + "\n" for _row in rows) + extra)
+    return str(path)
+
+
+def write_jsonl(path, lines):
+    path.write_text("".join(_line + "\n" for _line in lines))
+    return str(path)
+
+
+def records():
+    return [dict(zip(COLUMNS, _row)) for _row in ROWS]
+
+
+def test_csv_keeps_every_lane_of_a_read_group(handler_module, tmp_path):
+    manifest = write_csv(tmp_path / "manifest.csv")
+    assert list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest)) == EXPECTED
+
+
+def test_csv_skips_blank_lines_and_ignores_extra_columns(handler_module, tmp_path):
+    header = "platform,sample_name,read_group,fastq_1,fastq_2,lims_id\n"
+    rows = [(_row[4],) + _row[:4] + ("X",) for _row in ROWS]
+    manifest = write_csv(tmp_path / "manifest.csv", header=header, rows=rows, extra="\n")
+    assert list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest)) == EXPECTED
+
+
+def test_csv_missing_column(handler_module, tmp_path):
+    manifest = write_csv(tmp_path / "manifest.csv", header="sample_name,read_group,fastq_1,fastq_2\n")
+    with pytest.raises(Exception, match="CSV header, missing platform"):
+        list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest))
+
+
+def test_csv_short_row(handler_module, tmp_path):
+    manifest = write_csv(tmp_path / "manifest.csv", extra="S3,RG1,s3://b/S3_R1.fastq.gz\n")
+    with pytest.raises(Exception, match="CSV row at line 6"):
+        list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest))
+
+
+def test_csv_empty_field(handler_module, tmp_path):
+    manifest = write_csv(tmp_path / "manifest.csv", extra="S3,RG1,s3://b/S3_R1.fastq.gz,,illumina\n")
+    with pytest.raises(Exception, match="CSV row at line 6, empty fastq_2"):
+        list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest))
+
+
+def test_jsonl_manifest(handler_module, tmp_path):
+    lines = [json.dumps(dict(_record, lims_id="X")) for _record in records()]
+    manifest = write_jsonl(tmp_path / "manifest.jsonl", lines[:2] + [""] + lines[2:])
+    assert list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest)) == EXPECTED
+
+
+@pytest.mark.parametrize("line, message", [
+    ('{"sample_name": "S3", "read_group": "RG1", "fastq_1": "s3://b/R1", "fastq_2": null, "platform": "illumina"}', "line 2, empty fastq_2"),
+    ('{"sample_name": "S3", "read_group": "RG1", "fastq_1": "s3://b/R1", "platform": "illumina"}', "line 2, missing fastq_2"),
+    ('["S3"]', "line 2, not a JSON object"),
+    ('{"sample_name": ', "line 2, not valid JSON"),
+])
+def test_jsonl_invalid_record(handler_module, tmp_path, line, message):
+    manifest = write_jsonl(tmp_path / "manifest.jsonl", [json.dumps(records()[0]), line])
+    with pytest.raises(Exception, match=f"Invalid sample manifest JSONL record at {message}"):
+        list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest))
+
+
+def test_parquet_manifest(handler_module, tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    manifest = str(tmp_path / "manifest.parquet")
+    pq.write_table(pa.Table.from_pylist([dict(_record, lims_id="X") for _record in records()]), manifest)
+    assert list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest)) == EXPECTED
+
+
+def test_parquet_null_field(handler_module, tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    manifest = str(tmp_path / "manifest.parquet")
+    rows = records()
+    rows[1]["fastq_2"] = None
+    pq.write_table(pa.Table.from_pylist(rows), manifest)
+    with pytest.raises(Exception, match="Parquet row 2, empty fastq_2"):
+        list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest))
+
+
+def test_parquet_without_pyarrow(handler_module, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    monkeypatch.setitem(sys.modules, "pyarrow.parquet", None)
+    with pytest.raises(Exception, match="require pyarrow"):
+        list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(str(tmp_path / "manifest.parquet")))
+
+
+def test_unsupported_format(handler_module):
+    with pytest.raises(Exception, match="Unsupported sample manifest format"):
+        list(handler_module.build_input_payload_for_r2r_gatk_fastq2vcf("manifest.tsv"))
+
+
+def manifest_event(key="fastqs/manifest.csv"):
+    return {"Records": [{"s3": {
+        "object": {"key": key},
+        "bucket": {"arn": "arn:aws:s3:::input-bucket", "name": "input-bucket"},
+    }}]}
+
+
+def test_payloads_are_generated_one_sample_at_a_time(handler_module, tmp_path):
+    manifest = write_csv(tmp_path / "manifest.csv")
+    payloads = handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(manifest)
+    assert inspect.isgenerator(payloads)
+    assert next(payloads) == EXPECTED[0]
+    assert next(payloads) == EXPECTED[1]
+    assert next(payloads, None) is None
+
+
+def test_handler_launches_each_payload_before_building_the_next(handler_module, tmp_path, monkeypatch):
+    manifest = write_csv(tmp_path / "manifest.csv")
+    monkeypatch.setattr(handler_module, "localize_s3_file", lambda bucket, key, local_file: shutil.copy(manifest, local_file))
+    events = []
+    build_payloads = handler_module.build_input_payload_for_r2r_gatk_fastq2vcf
+
+    def recording_payloads(sample_manifest):
+        for _item in build_payloads(sample_manifest):
+            events.append(("payload", _item["sample_name"]))
+            yield _item
+
+    def start_run(**kwargs):
+        events.append(("start_run", kwargs["parameters"]["sample_name"]))
+        return {"id": "1"}
+
+    monkeypatch.setattr(handler_module, "build_input_payload_for_r2r_gatk_fastq2vcf", recording_payloads)
+    monkeypatch.setattr(handler_module.omics, "start_run", start_run, raising=False)
+
+    handler_module.handler(manifest_event(), None)
+
+    assert events == [("payload", "S1"), ("start_run", "S1"), ("payload", "S2"), ("start_run", "S2")]
+
+
+def test_large_manifest_memory_stays_flat(handler_module, tmp_path):
+    lanes, samples = 100000, 1000
+    path = tmp_path / "manifest.csv"
+    with open(path, "w") as manifest:
+        manifest.write(HEADER)
+        for _lane in range(lanes):
+            manifest.write(f"S{_lane % samples},RG{_lane % 4},s3://b/{_lane}_R1.fastq.gz,s3://b/{_lane}_R2.fastq.gz,illumina\n")
+
+    tracemalloc.start()
+    try:
+        index = handler_module.build_sample_index(str(path))
+        index_size = tracemalloc.get_traced_memory()[0]
+        del index
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        lane_count = 0
+        for _item in handler_module.build_input_payload_for_r2r_gatk_fastq2vcf(str(path)):
+            lane_count += len(_item["fastq_pairs"])
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+    assert lane_count == lanes
+    # the index plus one sample payload, not a second copy of every lane
+    assert peak < index_size * 1.25
+
+
+def test_rejected_payload_key_uses_full_manifest_key(handler_module):
+    params = {"sample_name": "S/1", "fastq_pairs": []}
+    uri = handler_module.store_rejected_parameters(params, "fastqs/batch1/manifest.csv")
+    assert uri == "s3://output-bucket/outputs/parameters/fastqs/batch1/manifest.csv/S%2F1.json"
+
+
+def test_handler_saves_rejected_payload_and_fails(handler_module, tmp_path, monkeypatch):
+    manifest = write_csv(tmp_path / "manifest.csv")
+    monkeypatch.setattr(handler_module, "localize_s3_file", lambda bucket, key, local_file: shutil.copy(manifest, local_file))
+    launched = []
+
+    def start_run(**kwargs):
+        if kwargs["parameters"]["sample_name"] == "S1":
+            raise handler_module.botocore.exceptions.ClientError(
+                {"Error": {"Code": "ValidationException", "Message": "parameters too large"}}, "StartRun")
+        launched.append(kwargs["parameters"])
+        return {"id": "1"}
+
+    monkeypatch.setattr(handler_module.omics, "start_run", start_run, raising=False)
+
+    with pytest.raises(Exception, match="Error launching 1 workflows"):
+        handler_module.handler(manifest_event("fastqs/batch1/manifest.csv"), None)
+
+    # the other sample is still launched
+    assert launched == [EXPECTED[1]]
+    [(s3_call, put)] = handler_module.s3.calls
+    assert s3_call == "put_object"
+    assert put["Bucket"] == "output-bucket"
+    assert put["Key"] == "outputs/parameters/fastqs/batch1/manifest.csv/S1.json"
+    assert json.loads(put["Body"]) == EXPECTED[0]